@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+try:
+    import resource # not on Windows
+except ImportError:
+    resource = None
+
+import gencorpus
+
+BENCHDIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHDIR.parent))
+import flare_to_md
+
+BASELINE = BENCHDIR / "baseline.json"
+GOLDEN = BENCHDIR / "golden"
+# The corpus the golden files were made from. If you change this (or gencorpus.py),
+# run with --update-golden and check the diff.
+GOLDEN_CORPUS = {"books": 2, "topics": 12, "blocks": 12, "seed": 1}
+
+def main():
+    """
+    Benchmarks flare-to-md.py on a synthetic Flare corpus (see gencorpus.py) and checks its
+    output against the golden files.
+
+        python bench/bench.py                      # benchmark, compared to bench/baseline.json if there is one
+        python bench/bench.py --save-baseline      # ...and save the result as the new baseline
+        python bench/bench.py --check-golden       # does the output still match bench/golden?
+        python bench/bench.py --update-golden      # the output changed on purpose, save it
+    """
+    parser = argparse.ArgumentParser(description="Benchmark flare-to-md.py on a synthetic Flare corpus.")
+    parser.add_argument("--corpus", help="use this docs-src dir instead of generating one (it gets converted in a copy)")
+    parser.add_argument("--books", type=int, default=2)
+    parser.add_argument("--topics", type=int, default=200, help="topics per book")
+    parser.add_argument("--blocks", type=int, default=40, help="block elements per topic")
+    parser.add_argument("--list-depth", type=int, default=4)
+    parser.add_argument("--table-rows", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--jobs", type=int, default=1, help="--jobs for the end-to-end run")
+    parser.add_argument("--repeat", type=int, default=3, help="run each measurement this many times and keep the best")
+    parser.add_argument("--baseline", default=str(BASELINE), help="baseline to compare with (default %(default)s)")
+    parser.add_argument("--save-baseline", action="store_true", help="save this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="how much slower than the baseline counts as a regression (default %(default)s = 15%%)")
+    parser.add_argument("--check-golden", action="store_true", help="only check the output against the golden files")
+    parser.add_argument("--update-golden", action="store_true", help="only rewrite the golden files from the current output")
+    args = parser.parse_args()
+
+    if args.check_golden or args.update_golden:
+        sys.exit(golden(args.update_golden))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = os.path.join(tmpdir, "docs-src")
+        if args.corpus:
+            shutil.copytree(os.path.join(args.corpus, "src"), os.path.join(workdir, "src"))
+        else:
+            gencorpus.gencorpus(workdir, books=args.books, topics=args.topics, blocks=args.blocks,
+                                list_depth=args.list_depth, table_rows=args.table_rows, seed=args.seed)
+        results = bench(workdir, args.jobs, args.repeat)
+
+    report(results)
+    status = 0
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            status = compare(results, json.load(f), args.tolerance)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        print("saved baseline to "+args.baseline)
+    sys.exit(status)
+
+def flarebooks(workdir):
+    """ the books in the corpus' topic.yml with flare: true """
+    import yaml
+    with open(os.path.join(workdir, "src", "_data", "topic.yml")) as f:
+        return [book["link"] for book in yaml.safe_load(f) if book.get("flare")]
+
+def bench(workdir, jobs, repeat):
+    """
+        Times the converter on the corpus in workdir. Returns a dict of results.
+        end-to-end is convertbook() from scratch, the way the script runs it.
+        The phases are timed separately, one topic at a time:
+            copy: linking/copying the non-topic files from src/_<book> to src/<book> (syncfile)
+            parse: ET.parse of each topic
+            convert: turning the parsed topic into markdown, in memory
+            write: writing the markdown out
+    """
+    books = flarebooks(workdir)
+    topics = []
+    for bookname in books:
+        topics += sorted(Path(workdir, "src", "_"+bookname).rglob("*.html"))
+    inbytes = sum(t.stat().st_size for t in topics)
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        # end to end
+        def endtoend():
+            for bookname in books:
+                shutil.rmtree("src/"+bookname, ignore_errors=True)
+            pool = None
+            if jobs > 1:
+                pool = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    errors = []
+                    for bookname in books:
+                        errors += flare_to_md.convertbook("src/_"+bookname, "src/"+bookname, pool, jobs)
+            finally:
+                if pool:
+                    pool.shutdown()
+            if errors:
+                raise RuntimeError("conversion failed: "+"; ".join(errors[:5]))
+        total = best(endtoend, repeat)
+
+        outbytes = sum(p.stat().st_size for bookname in books for p in Path("src", bookname).rglob("*.md"))
+
+        # the phases
+        def copy():
+            for bookname in books:
+                shutil.rmtree("src/"+bookname, ignore_errors=True)
+                for srcfname in Path("src/_"+bookname).rglob("*"):
+                    if srcfname.is_file() and srcfname.suffix != ".html":
+                        destfname = Path("src", bookname, srcfname.relative_to("src/_"+bookname))
+                        destfname.parent.mkdir(parents=True, exist_ok=True)
+                        flare_to_md.syncfile(srcfname, destfname, srcfname.stat())
+        copytime = best(copy, repeat)
+
+        roots = []
+        def parse():
+            roots[:] = [ET.parse(t).getroot() for t in topics]
+        parsetime = best(parse, repeat)
+
+        outputs = []
+        def convert():
+            outputs[:] = [flare_to_md.convertroot(root).getvalue() for root in roots]
+        converttime = best(convert, repeat)
+
+        outdir = Path(workdir, "write")
+        outdir.mkdir()
+        def write():
+            for i, mdout in enumerate(outputs):
+                with open(outdir / ("%d.md" % i), "w") as f:
+                    f.write(mdout)
+        writetime = best(write, repeat)
+    finally:
+        os.chdir(cwd)
+
+    return {
+        "topics": len(topics),
+        "input_mb": inbytes / 1e6,
+        "output_mb": outbytes / 1e6,
+        "jobs": jobs,
+        "total_s": total,
+        "topics_per_s": len(topics) / total,
+        "mb_per_s": inbytes / 1e6 / total,
+        "copy_s": copytime,
+        "parse_s": parsetime,
+        "convert_s": converttime,
+        "write_s": writetime,
+        "peak_rss_mb": peakrss(),
+        "python": sys.version.split()[0],
+    }
+
+def best(fn, repeat):
+    """ runs fn repeat times, returns the fastest time in seconds """
+    times = []
+    for i in range(max(1, repeat)):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def peakrss():
+    """ peak resident set size of this process (and any --jobs workers) in MB, or None if we can't tell """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == "darwin":
+        return rss / 1e6 # bytes on a Mac
+    return rss / 1e3 # KB everywhere else
+
+def report(r):
+    print("%d topics, %.1f MB in, %.1f MB out, --jobs %d, Python %s" % (r["topics"], r["input_mb"], r["output_mb"], r["jobs"], r["python"]))
+    print("    end to end: %8.3fs  %8.1f topics/s  %6.2f MB/s" % (r["total_s"], r["topics_per_s"], r["mb_per_s"]))
+    for phase in ("copy", "parse", "convert", "write"):
+        print("    %-10s  %8.3fs" % (phase+":", r[phase+"_s"]))
+    if r["peak_rss_mb"] is not None:
+        print("    peak RSS:   %8.1f MB" % r["peak_rss_mb"])
+
+def compare(r, base, tolerance):
+    """ prints how this run compares to the baseline. Returns 1 if anything got slower than tolerance allows. """
+    print("compared to baseline (Python %s):" % base.get("python", "?"))
+    if r["topics"] != base.get("topics"):
+        print("    NOTE: different corpus (%s topics in the baseline), times aren't comparable" % base.get("topics"))
+    status = 0
+    for key in ("total_s", "copy_s", "parse_s", "convert_s", "write_s"):
+        if not base.get(key):
+            continue
+        change = (r[key] - base[key]) / base[key]
+        flag = ""
+        if change > tolerance:
+            flag = "  <-- SLOWER"
+            status = 1
+        print("    %-10s %8.3fs -> %8.3fs  %+6.1f%%%s" % (key[:-2]+":", base[key], r[key], change * 100, flag))
+    return status
+
+def golden(update):
+    """
+        Converts the GOLDEN_CORPUS and compares the .md files with bench/golden (or rewrites them if update).
+        Returns 0 if they all match.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        gencorpus.gencorpus(tmpdir, **GOLDEN_CORPUS)
+        cwd = os.getcwd()
+        os.chdir(tmpdir)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                errors = []
+                for bookname in flarebooks(tmpdir):
+                    errors += flare_to_md.convertbook("src/_"+bookname, "src/"+bookname)
+        finally:
+            os.chdir(cwd)
+        if errors:
+            print("conversion failed: "+"; ".join(errors))
+            return 1
+
+        outputs = {}
+        for bookname in flarebooks(tmpdir):
+            for p in Path(tmpdir, "src", bookname).rglob("*.md"):
+                outputs[p.relative_to(Path(tmpdir, "src")).as_posix()] = p.read_bytes()
+
+    if update:
+        shutil.rmtree(GOLDEN, ignore_errors=True)
+        for relname, data in outputs.items():
+            (GOLDEN / relname).parent.mkdir(parents=True, exist_ok=True)
+            (GOLDEN / relname).write_bytes(data)
+        print("wrote %d golden files to %s" % (len(outputs), GOLDEN))
+        return 0
+
+    expected = {p.relative_to(GOLDEN).as_posix(): p.read_bytes() for p in GOLDEN.rglob("*.md")}
+    bad = 0
+    for relname in sorted(set(expected) | set(outputs)):
+        if relname not in outputs:
+            print("missing: "+relname)
+        elif relname not in expected:
+            print("new (not in golden): "+relname)
+        elif outputs[relname] != expected[relname]:
+            print("different: "+relname)
+        else:
+            continue
+        bad += 1
+    if bad:
+        print("%d of %d files don't match the golden output" % (bad, len(expected)))
+        return 1
+    print("all %d files match the golden output" % len(expected))
+    return 0
+
+if __name__ == "__main__":
+    main()
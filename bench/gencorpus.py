@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import random
+
+# Words used for the fake topic text. The odd ones are there on purpose:
+# & and < get escaped, and the non-ascii ones come out as &#NNN; refs.
+WORDS = ["flare", "topic", "widget", "server", "config", "cluster", "node", "query",
+         "table", "index", "value", "option", "default", "setting", "install", "user",
+         "admin", "network", "port", "file", "path", "log", "error", "retry", "timeout",
+         "R&D", "a<b", "x>y", "Widget™", "Acme®", "non breaking", "café"]
+
+# One hand-written topic with every case the converter documents (0-11), plus the odd stuff
+# that has bitten us: empty elements, attributes that need escaping, tags nested in links,
+# text after the last element, and so on.
+EDGE_TOPIC = """<?xml version="1.0" encoding="utf-8"?>
+<html>
+    <head>
+        <title>Edge: cases&#8482; &amp; stuff
+        </title>
+    </head>
+    <body>stray body text
+        <h1>Edge cases</h1>
+        <p>The description,   with   spaces
+           over two lines.</p>
+        <h2>Headings</h2>
+        <h3>Three</h3>
+        <h4>Four</h4>
+        <h5>Five</h5>
+        <h2 class="x">Heading with a class</h2>
+        <p>Void tags: <br /> an image <img src="Resources/Images/image0.png" alt="a &quot;quoted&quot; alt&#10;with a newline" /> and empties <span class="b"></span></p>
+        <p />
+        <p></p>
+        <p class="left">left</p>
+        <p class="code">code line one
+    code line two</p>
+        <p class="code" id="c1">code with an id</p>
+        <p class="codeIndent">code indent</p>
+        <p class="Caption">A caption</p>
+        <p class="centered">centered</p>
+        <p class="SeeItem">See item one</p>
+        <p class="SeeItem">See item two</p>
+        <p class="mystery">unknown class</p>
+        <div class="note">
+            <p>A note, which the div eats.</p>
+        </div>
+        <ul>
+            <li>one</li>
+            <li>two
+                <ol>
+                    <li>two a <p class="left">left in a list</p><p class="code">code in a list</p></li>
+                    <li>two b
+                        <ul>
+                            <li>deep <p class="SeeItem">see</p><p class="Caption">cap</p><p class="centered">cen</p></li>
+                        </ul>
+                    </li>
+                </ol>
+            </li>
+        </ul>
+        <p>Links: <a href="hello/index.html">internal</a>, <a href="https://example.com/">external</a>,
+            <a href="index.html#sec1">with a fragment</a>, <a href="x.html"><span class="b">bold</span> in a link</a>,
+            <a href="y.html"><b><i>deep</i> nest</b> tail</a>, <a name="bookmark"></a>, <a class="httpish" href="z.html">fake external</a>,
+            and <a name="nohref">no href</a>.</p>
+        <p>Spans: <span class="b">b</span> <span class="i">i</span> <span class="code">code</span>
+            <span class="function">function</span> <span class="blue">blue</span> <span class="red">red</span>
+            <span class="i" title="t">i with a title</span> <span style="x">dropped</span></p>
+        <table style="width: 100%;">
+            <tr>
+                <td><p>in a table <span class="b">b</span> <span class="i">i</span> <span class="code">code</span>
+                    <span class="function">fn</span> <span class="blue">blue</span> <span class="other">other</span>
+                    <a href="t.html">table link</a> <a href="http://example.com">table external</a></p></td>
+                <td><ul><li>list in a table</li></ul><p attr="a&quot;b&lt;c&#10;d&#9;&#233;&amp;">escaped attributes</p></td>
+            </tr>
+        </table>
+        <pre>a pre block</pre>
+        <p>Non-ascii: caf&#233; &#8482; &#174; non&#160;breaking, and escapes: R&amp;D a&lt;b x&gt;y</p>
+        <p>last</p>   text after the last element
+    </body>
+</html>"""
+
+SPAN_CLASSES = ["b", "i", "code", "blue", "red", "function", "other"]
+P_CLASSES = ["left", "code", "codeIndent", "Caption", "centered", "SeeItem", "mystery"]
+
+def main():
+    """
+    Writes a synthetic Flare clean XHTML corpus so the converter can be benchmarked
+    and checked without a real Flare project.
+
+    Makes a docs-src style layout in the output dir:
+        src/_data/topic.yml
+        src/_<book>/...  (topics, in subdirs, plus a few fake images)
+    book0 also gets edgecases.html, see EDGE_TOPIC.
+    """
+    parser = argparse.ArgumentParser(description="Generate a synthetic Flare XHTML corpus.")
+    parser.add_argument("outdir", help="where to write the docs-src tree")
+    parser.add_argument("--books", type=int, default=2, help="number of Flare books")
+    parser.add_argument("--topics", type=int, default=50, help="topics per book")
+    parser.add_argument("--blocks", type=int, default=20, help="block elements per topic (controls topic size)")
+    parser.add_argument("--list-depth", type=int, default=3, help="max nesting for ul/ol lists")
+    parser.add_argument("--table-rows", type=int, default=6, help="max rows per table")
+    parser.add_argument("--dirs", type=int, default=4, help="subdirectories per book")
+    parser.add_argument("--assets", type=int, default=5, help="non-html files per book")
+    parser.add_argument("--seed", type=int, default=1, help="random seed, same seed gives the same corpus")
+    parser.add_argument("--no-edge", dest="edge", action="store_false",
+                        help="leave out the hand-written edgecases.html topic")
+    args = parser.parse_args()
+
+    gencorpus(args.outdir, books=args.books, topics=args.topics, blocks=args.blocks,
+              list_depth=args.list_depth, table_rows=args.table_rows, dirs=args.dirs,
+              assets=args.assets, seed=args.seed, edge=args.edge)
+
+def gencorpus(outdir, books=2, topics=50, blocks=20, list_depth=3, table_rows=6, dirs=4, assets=5, seed=1, edge=True):
+    rnd = random.Random(seed)
+    os.makedirs(os.path.join(outdir, "src", "_data"), exist_ok=True)
+
+    toc = []
+    for b in range(books):
+        bookname = "book%d" % b
+        toc.append("- title: Book %d\n  link: %s\n  flare: true\n" % (b, bookname))
+        bookdir = os.path.join(outdir, "src", "_" + bookname)
+
+        # topic paths, relative to the book. index.html is always at the root.
+        paths = ["index.html"]
+        for t in range(1, topics):
+            if dirs:
+                paths.append("dir%d/topic%d.html" % (rnd.randrange(dirs), t))
+            else:
+                paths.append("topic%d.html" % t)
+
+        for path in paths:
+            fname = os.path.join(bookdir, path)
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+            with open(fname, "w", encoding="utf-8") as f:
+                f.write(gentopic(rnd, path, paths, blocks, list_depth, table_rows))
+
+        if edge and b == 0:
+            with open(os.path.join(bookdir, "edgecases.html"), "w", encoding="utf-8") as f:
+                f.write(EDGE_TOPIC)
+
+        for a in range(assets):
+            fname = os.path.join(bookdir, "Resources", "Images", "image%d.png" % a)
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+            with open(fname, "wb") as f:
+                f.write(bytes(rnd.randrange(256) for i in range(rnd.randrange(200, 4000))))
+
+    # a non-flare book, which should be left alone
+    toc.append("- title: Not Flare\n  link: notflare\n")
+    with open(os.path.join(outdir, "src", "_data", "topic.yml"), "w") as f:
+        f.write("".join(toc))
+
+def words(rnd, lo=3, hi=12):
+    return " ".join(rnd.choice(WORDS) for i in range(rnd.randint(lo, hi)))
+
+def esc(s):
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def link(rnd, path, paths):
+    if rnd.random() < 0.3:
+        return '<a href="https://example.com/%s">%s</a>' % (rnd.choice(WORDS[:10]), esc(words(rnd, 1, 3)))
+    target = os.path.relpath(rnd.choice(paths), os.path.dirname(path) or ".").replace(os.sep, "/")
+    if rnd.random() < 0.3:
+        target += "#sec%d" % rnd.randrange(3)
+    if rnd.random() < 0.3:
+        # a link with a nested span, case 11
+        return '<a href="%s"><span class="%s">%s</span> %s</a>' % (target, rnd.choice(SPAN_CLASSES), esc(words(rnd, 1, 2)), esc(words(rnd, 1, 2)))
+    return '<a href="%s">%s</a>' % (target, esc(words(rnd, 1, 3)))
+
+def inline(rnd, path, paths):
+    """ some text with spans, links, and the odd void tag """
+    out = [esc(words(rnd))]
+    for i in range(rnd.randint(0, 4)):
+        r = rnd.random()
+        if r < 0.45:
+            out.append('<span class="%s">%s</span>' % (rnd.choice(SPAN_CLASSES), esc(words(rnd, 1, 4))))
+        elif r < 0.8:
+            out.append(link(rnd, path, paths))
+        elif r < 0.9:
+            out.append('<br />')
+        else:
+            out.append('<img src="Resources/Images/image0.png" alt="%s" />' % esc(words(rnd, 1, 2)))
+        out.append(esc(words(rnd, 0, 6)))
+    return " ".join(out)
+
+def genlist(rnd, path, paths, depth, maxdepth, indent):
+    tag = rnd.choice(["ul", "ol"])
+    pad = " " * indent
+    out = [pad + "<%s>" % tag]
+    for i in range(rnd.randint(1, 4)):
+        out.append(pad + "    <li>")
+        if rnd.random() < 0.5:
+            out.append(pad + "        <p>%s</p>" % inline(rnd, path, paths))
+        else:
+            out.append(pad + "        %s" % inline(rnd, path, paths))
+        if rnd.random() < 0.3:
+            out.append(pad + '        <p class="%s">%s</p>' % (rnd.choice(P_CLASSES), inline(rnd, path, paths)))
+        if depth < maxdepth and rnd.random() < 0.4:
+            out.extend(genlist(rnd, path, paths, depth + 1, maxdepth, indent + 8))
+        out.append(pad + "    </li>")
+    out.append(pad + "</%s>" % tag)
+    return out
+
+def gentable(rnd, path, paths, maxrows):
+    cols = rnd.randint(2, 4)
+    out = ['<table style="width: 100%;">', '    <col />' * 1, '    <thead>', '        <tr>']
+    for c in range(cols):
+        out.append('            <th>%s</th>' % esc(words(rnd, 1, 3)))
+    out += ['        </tr>', '    </thead>', '    <tbody>']
+    for r in range(rnd.randint(1, maxrows)):
+        out.append('        <tr>')
+        for c in range(cols):
+            if rnd.random() < 0.5:
+                out.append('            <td><p>%s</p></td>' % inline(rnd, path, paths))
+            else:
+                out.append('            <td>%s</td>' % inline(rnd, path, paths))
+        out.append('        </tr>')
+    out += ['    </tbody>', '</table>']
+    return out
+
+def gentopic(rnd, path, paths, blocks, list_depth, table_rows):
+    title = words(rnd, 2, 5).title()
+    body = ["<h1>%s</h1>" % esc(title), "<p>%s</p>" % esc(words(rnd, 6, 20))]
+    for b in range(rnd.randint(max(1, blocks // 2), blocks)):
+        r = rnd.random()
+        if r < 0.3:
+            body.append("<p>%s</p>" % inline(rnd, path, paths))
+        elif r < 0.4:
+            h = rnd.choice(["h2", "h3", "h4"])
+            body.append('<%s>%s</%s>' % (h, esc(words(rnd, 2, 5)), h))
+        elif r < 0.45:
+            body.append('<h2><a name="sec%d"></a>%s</h2>' % (rnd.randrange(3), esc(words(rnd, 2, 5))))
+        elif r < 0.6:
+            body.extend(genlist(rnd, path, paths, 1, list_depth, 0))
+        elif r < 0.7:
+            body.extend(gentable(rnd, path, paths, table_rows))
+        elif r < 0.78:
+            cls = rnd.choice(["code", "codeIndent"])
+            code = "\n".join("    " * rnd.randrange(3) + esc(words(rnd, 2, 6)) for i in range(rnd.randint(1, 5)))
+            body.append('<p class="%s">%s</p>' % (cls, code))
+        elif r < 0.86:
+            body.append('<p class="%s">%s</p>' % (rnd.choice(P_CLASSES), inline(rnd, path, paths)))
+        elif r < 0.92:
+            body.append('<div class="note">')
+            body.append('    <p>%s</p>' % inline(rnd, path, paths))
+            body.append('</div>')
+        elif r < 0.96:
+            body.append('<pre>%s</pre>' % esc(words(rnd)))
+        else:
+            body.append('<p />')
+    inner = "\n".join("        " + line for line in "\n".join(body).split("\n"))
+    return ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<html>\n'
+            '    <head>\n'
+            '        <meta charset="utf-8" />\n'
+            '        <title>%s</title>\n'
+            '    </head>\n'
+            '    <body>\n'
+            '%s\n'
+            '    </body>\n'
+            '</html>' % (esc(title), inner))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1497 @@
+#!/usr/bin/env python3
+
+import yaml
+import os
+import shutil
+from pathlib import Path
+import xml.etree.ElementTree as ET
+import textwrap
+import re
+import sys
+import hashlib
+import json
+import posixpath
+import urllib.parse
+import argparse
+import concurrent.futures
+import collections
+import string
+import time
+import cProfile
+try:
+    import fcntl # for reflinks, not on Windows
+except ImportError:
+    fcntl = None
+
+# The manifest lives in the converted book dir. Jekyll skips dotfiles, so it doesn't end up on the site.
+MANIFEST_NAME = ".flare-manifest.json"
+# Bump this whenever the conversion output changes, so old manifests get thrown away
+# and every topic is converted again.
+CONVERTER_VERSION = 6
+
+# The kinds of pieces walkbody() hands back
+OPEN, VOID, CLOSE, TEXT = range(4)
+# a line break and any whitespace around it, which gets squashed out of text
+LINEBREAK_RE = re.compile(r"\s*\n\s*")
+HREF_RE = re.compile("href=\"([^\"]*)\"")
+HEADING_TAGS = frozenset(["h1", "h2", "h3", "h4", "h5", "h6"])
+# mailto:, ftp: and so on. checklinks() leaves these alone.
+SCHEME_RE = re.compile(r"[A-Za-z][A-Za-z0-9+.-]*:")
+
+# What each tag turns into. Each rule has:
+#   tag: the element name
+#   class: only for this class attribute. Leave it out to match any class (or none).
+#   table: true = only inside a table, false = only outside one. Leave it out for both.
+#   open, close: what to write for the open and close tag. These can use:
+#       {tag}     the tag itself, as it was in the XHTML (so "{tag}" passes it through)
+#       {indent}  four spaces per list level
+#       {listindent}  four spaces per list level above one (for <li>)
+#       {bullet}  "* " inside a <ul>, "1. " inside an <ol>
+#       {guts}, {href}  (capture rules only) what was inside the tag, and its href
+#   capture: true for anchors. Everything inside is held back until the close tag, and the
+#       close template gets {guts} and {href}. External (http*) links are left as they are.
+# A more specific rule wins: class over no class. Anything with no rule is passed through.
+# Void tags (<br />, <img />, empty elements) are always passed through.
+# More rules can be added, or these replaced, with --rules rules.yml (a list of the same thing).
+DEFAULT_RULES = [
+    # 1. <h1>-<h4> become "# " - "#### ", 7. </h1>-</h4> become two linebreaks
+    {"tag": "h1", "open": "# ", "close": "\n\n"},
+    {"tag": "h2", "open": "## ", "close": "\n\n"},
+    {"tag": "h3", "open": "### ", "close": "\n\n"},
+    {"tag": "h4", "open": "\n#### ", "close": "\n\n"},
+    {"tag": "h5", "open": "{tag}", "close": "\n\n"},
+    {"tag": "h6", "open": "{tag}", "close": "\n\n"},
+    # 2. <p> becomes a blank line, 2a. <p></p> inside tables are preserved
+    {"tag": "p", "table": True, "open": "{tag}", "close": "{tag}"},
+    {"tag": "p", "table": False, "open": "\n", "close": "\n"},
+    # 2b. <p class="*"> gets indented per list level
+    {"tag": "p", "class": "left", "table": False, "open": "\n{indent}", "close": "\n"},
+    {"tag": "p", "class": "code", "table": False, "open": "{indent}<pre>\n", "close": "\n</pre>\n\n"},
+    {"tag": "p", "class": "codeIndent", "table": False, "open": "{indent}<pre>\n", "close": "</pre>\n"},
+    {"tag": "p", "class": "Caption", "table": False, "open": "\n{indent}***", "close": "***\n\n"},
+    {"tag": "p", "class": "centered", "table": False, "open": "\n{indent}", "close": "\n"},
+    {"tag": "p", "class": "SeeItem", "table": False, "open": "\n{indent}* ", "close": "\n"},
+    # 3. <div*> becomes a blank line NOTE: this kills all divs, including note, tip, etc.
+    {"tag": "div", "open": "\n", "close": "\n"},
+    # 4. <ul*> and <ol*> become a blank line
+    {"tag": "ul", "open": "\n", "close": "\n"},
+    {"tag": "ol", "open": "\n", "close": "\n"},
+    # 5. <li> becomes "* " or "1. ", nested with four spaces per list level above one
+    {"tag": "li", "open": "{listindent}{bullet}", "close": "\n"},
+    # 6. Internal links become markdown links, or <a href="./..."> inside tables
+    {"tag": "a", "table": True, "capture": True, "close": "<a href=\"./{href}\">{guts}</a>"},
+    {"tag": "a", "table": False, "capture": True, "close": "[{guts}](./{href})"},
+    # 9. spans. blue and red must be replaced with HTML - no markdown!
+    {"tag": "span", "class": "blue", "open": "<span style=\"color:blue\">", "close": "</span>"},
+    {"tag": "span", "class": "red", "open": "<span style=\"color:red\">", "close": "</span>"},
+    # inside tables they are transformed to other HTML. No markdown!
+    {"tag": "span", "class": "b", "table": True, "open": "<b>", "close": "</b>"},
+    {"tag": "span", "class": "function", "table": True, "open": "<b>", "close": "</b>"},
+    {"tag": "span", "class": "i", "table": True, "open": "<i>", "close": "</i>"},
+    {"tag": "span", "class": "code", "table": True, "open": "<code>", "close": "</code>"},
+    {"tag": "span", "table": True, "open": "{tag}", "close": "{tag}"},
+    {"tag": "span", "class": "b", "table": False, "open": "**", "close": "**"},
+    {"tag": "span", "class": "function", "table": False, "open": "**", "close": "**"},
+    {"tag": "span", "class": "i", "table": False, "open": "*", "close": "*"},
+    {"tag": "span", "class": "code", "table": False, "open": "<code>", "close": "</code>"},
+    {"tag": "span", "table": False, "open": "", "close": ""}, # eats any other span tags
+    {"tag": "table", "open": "{tag}", "close": "{tag}\n"},
+]
+TEMPLATE_FIELDS = ("tag", "indent", "listindent", "bullet", "guts", "href")
+
+# the Linux ioctl for a copy-on-write clone (see reflink())
+FICLONE = 0x40049409
+
+# set by --cprofile, wrapped around the conversion of each topic
+CPROFILE = None
+
+# the TOC, with the flare: true books in it
+TOC = "src/_data/topic.yml"
+# where each book's topic list goes (see writebookdata()), as <book>.json. Jekyll has it as site.data.flare.<book>
+DATADIR = "src/_data/flare"
+# what convertfile() finds out about each topic that gets kept in the manifest: for checklinks() and writebookdata()
+TOPIC_INFO = ("anchors", "links", "title", "description", "headings", "words")
+# --watch looks for changes this often (seconds), and rebuilds once nothing has changed for WATCH_QUIET,
+# so a Flare export that writes hundreds of files is one rebuild, not hundreds
+WATCH_POLL = 0.1
+WATCH_QUIET = 0.2
+# and trims the --cache every this many rebuilds (and when it stops), not after every one
+WATCH_TRIM = 50
+
+Rule = collections.namedtuple("Rule", "open close capture name")
+TagRecord = collections.namedtuple("TagRecord", "tag cls rule")
+
+def main():
+    """
+    Converts Madcap Flare clean XHTML output to Markdown, suitable for Jekyll.
+    
+    Jon Konrath (jkonrath@rumored.com)
+
+    You need to do this one-time install:
+        python -m pip install pyyaml
+    If you're not sure you have these installed:
+        python -m pip list
+
+    Warning: this is an incredibly bespoke application and I'm not a good Python developer. I doubt
+    this would work out of the box for you, but maybe it's a proof of concept of what you could do.
+
+    This assumes you're in a docs-src directory that has a very specific topic.yml file for TOC that 
+    was used for a home-grown Jekyll TOC that you probably don't have.
+    This goes through the src/_data/topic.yml and finds any items with flare: true flag set.
+    """
+    parser = argparse.ArgumentParser(description="Converts Madcap Flare clean XHTML output to Markdown, suitable for Jekyll.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="convert topics in this many processes at once (0 = one per CPU). Default is 1.")
+    parser.add_argument("--book", metavar="NAME", action="append",
+                        help="only convert this book (its link in topic.yml). Can be given more than once.")
+    parser.add_argument("--rules", metavar="RULES.yml",
+                        help="extra tag/class rules, added to (or replacing) the built-in ones. See DEFAULT_RULES.")
+    parser.add_argument("--link-ext", metavar="EXT", default=".html",
+                        help="what internal links to topics end in. The default, .html, is what Jekyll serves the .md files as. "
+                             "Use .md for jekyll-relative-links, or \"\" for permalinks with no extension.")
+    parser.add_argument("--link-report", metavar="REPORT.json",
+                        help="also write the broken links (see the end of the run) to REPORT.json")
+    parser.add_argument("--copy-assets", action="store_true",
+                        help="always copy images and other non-topic files, instead of hard linking them")
+    parser.add_argument("--profile", metavar="REPORT.json", nargs="?", const="flare-profile.json",
+                        help="time every topic converted (parse, convert, write) and count the rules used, "
+                             "write it all to REPORT.json (default flare-profile.json) and print the slowest topics. "
+                             "Only topics that actually get converted this run are in it.")
+    parser.add_argument("--cache", metavar="DIR",
+                        help="keep converted topics in DIR, keyed on the topic's contents, the converter version and the rules, "
+                             "and copy them from there instead of converting them again. DIR can be shared by builds.")
+    parser.add_argument("--cache-size", metavar="MB", type=float, default=1024,
+                        help="when the cache is bigger than this, the least recently used topics are deleted (default %(default)s MB)")
+    parser.add_argument("--watch", action="store_true",
+                        help="after converting, keep running and convert again whenever the Flare output or topic.yml changes. "
+                             "Ctrl-C to stop.")
+    parser.add_argument("--cprofile", metavar="FILE",
+                        help="also run the conversion under cProfile and dump the stats to FILE (for pstats/snakeviz). "
+                             "Runs with --jobs 1.")
+    args = parser.parse_args()
+    loadrules(args.rules, args.link_ext)
+    jobs = args.jobs or os.cpu_count() or 1
+    profile = None
+    if args.profile or args.cprofile:
+        profile = []
+    if args.cprofile:
+        global CPROFILE
+        CPROFILE = cProfile.Profile()
+        jobs = 1 # the profile would be stuck in the worker processes
+
+    print("Running flare-to-md with Python "+sys.version)
+    errors = []
+    summary = collections.Counter()
+    pool = None
+    if jobs > 1:
+        pool = startpool(jobs, args.rules, args.link_ext)
+    try:
+        books = flarebooks(only=args.book)
+        times = {}
+        index = {}
+        errors = convertbooks(books, pool, jobs, profile, args.copy_assets, summary, args.cache, times, index)
+        print("Flare to MD conversion finished: %d files written, %d unchanged, %d removed."
+              % (summary["written"], summary["unchanged"], summary["removed"]))
+        for bookname in books:
+            print("    %-20s %8.3fs" % (bookname, times[bookname]))
+        if args.cache:
+            evicted = trimcache(args.cache, args.cache_size * 1024 * 1024)
+            print("Cache: %d hits, %d misses, %d evicted." % (summary["hit"], summary["miss"], evicted))
+        if profile is not None:
+            writeprofile(profile, args.profile or "flare-profile.json")
+        if CPROFILE:
+            CPROFILE.dump_stats(args.cprofile)
+            print("cProfile stats written to "+args.cprofile)
+        reportlinks(*checklinks(index), reportfname=args.link_report)
+        printerrors(errors)
+        if args.watch:
+            watch(books, pool, jobs, args, index)
+    finally:
+        if pool:
+            pool.shutdown()
+    if errors:
+        sys.exit(1)
+
+def flarebooks(tocfname=TOC, only=None):
+    """ The books in topic.yml with flare: true, in TOC order. If only is a list of names, just those (see --book). """
+    books = []
+    # iterate through the src/data/topic.yml file
+    with open(tocfname) as f:
+        # the libyaml one is a lot faster on a big TOC, if pyyaml was built with it
+        data = yaml.load(f, Loader=getattr(yaml, "CFullLoader", yaml.FullLoader))
+        for book in data:
+            bookname = book["link"]
+            if only and bookname not in only:
+                continue
+            if "flare" in book:
+                print("    "+bookname+" is a Flare book.")
+                if book["flare"]: # you *could* set flare: false
+                    books.append(bookname)
+    for bookname in only or []:
+        if bookname not in books:
+            print("    "+bookname+" isn't a Flare book in "+tocfname+", skipping it.")
+    return books
+
+def startpool(jobs, rulesfname, linkext):
+    """
+        The worker processes for --jobs, each with the rules loaded (see loadrules()). They're all started
+        right away, before convertbooks() has any threads going: on Linux they're forked, and a fork while
+        another thread is in the middle of something (holding a lock) can leave the worker stuck for good.
+    """
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=loadrules, initargs=(rulesfname, linkext))
+    # with fork, the first job starts every worker, not just one
+    pool.submit(int).result()
+    return pool
+
+def convertbooks(books, pool, jobs, profile, copyassets, summary, cachedir, times=None, index=None):
+    """
+        Converts each book in books (see convertbook). Returns the errors from all of them, in TOC order.
+        With a pool (see startpool()), several books are converted at once, each in a thread of its own that
+        hands its topics to the same pool, so --jobs is the limit for the whole run and not per book. The biggest books start
+        first, so the run isn't left waiting on one big book at the end. Each book's log is held back and
+        printed in one piece when it's done, so they don't get mixed up.
+        If times is a dict, how long each book took (in seconds) goes in it.
+        If index is a dict, every file in every book goes in it, for checklinks().
+    """
+    if times is None:
+        times = {}
+    results = {}
+    if pool is None or len(books) < 2:
+        for bookname in books:
+            results[bookname] = convertonebook(bookname, pool, jobs, profile, copyassets, cachedir, print, index)
+    else:
+        order = sorted(books, key=booksize, reverse=True)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(books), jobs)) as threads:
+            futures = {}
+            for bookname in order:
+                lines = []
+                futures[threads.submit(convertonebook, bookname, pool, jobs, profile, copyassets, cachedir, lines.append, index)] = (bookname, lines)
+            for future in concurrent.futures.as_completed(futures):
+                bookname, lines = futures[future]
+                results[bookname] = future.result()
+                print("\n".join(lines))
+    errors = []
+    for bookname in books:
+        bookerrors, counts, times[bookname] = results[bookname]
+        errors += bookerrors
+        summary.update(counts)
+    return errors
+
+def convertonebook(bookname, pool, jobs, profile, copyassets, cachedir, log, index=None):
+    """ convertbook() for a book from topic.yml. Returns (errors, counts, seconds it took). """
+    start = time.perf_counter()
+    counts = collections.Counter()
+    log("    converting "+bookname)
+    errors = convertbook("src/_"+bookname, "src/"+bookname, pool, jobs, profile, copyassets, counts, log, cachedir, index,
+                         os.path.join(DATADIR, bookname+".json"))
+    log("    "+bookname+" conversion finished.")
+    return errors, counts, time.perf_counter() - start
+
+def booksize(bookname):
+    """
+        Roughly how much work a book is: the size of its source. This is just a stat of each file, where
+        reading the manifest would mean parsing it here and then again in convertbook().
+    """
+    return sum(size for size, mtime in snapshot("src/_"+bookname).values())
+
+def printerrors(errors):
+    if errors:
+        print(str(len(errors))+" topic(s) could not be converted:")
+        for error in errors:
+            print("    "+error)
+
+def watch(books, pool, jobs, args, index):
+    """
+        --watch: keeps going after the first conversion, and converts a book again whenever anything
+        in its src/_<book> changes (the manifest makes sure only the changed topics actually get converted).
+        If topic.yml changes, it's read again, so a book that gets flare: true is converted and watched too.
+        This polls (every WATCH_POLL seconds), so it works the same everywhere with nothing else installed,
+        and waits for things to be quiet for WATCH_QUIET seconds first, so a whole Flare export is one rebuild.
+        index is what the first conversion put in it (see checklinks()), and is kept up to date, so the links
+        are checked again after each rebuild.
+        The --cache is trimmed every WATCH_TRIM rebuilds and when it stops (main() did it before it started).
+        Runs until Ctrl-C.
+    """
+    print("Watching for changes. Ctrl-C to stop.")
+    tocmtime = statmtime(TOC)
+    snapshots = {bookname: snapshot("src/_"+bookname) for bookname in books}
+    changed = set()
+    rebuilds = 0
+    firstchange = lastchange = None
+    try:
+        while True:
+            time.sleep(WATCH_POLL)
+            now = time.monotonic()
+            mtime = statmtime(TOC)
+            if mtime is not None and mtime != tocmtime:
+                tocmtime = mtime
+                try:
+                    books = flarebooks(only=args.book)
+                except (OSError, yaml.YAMLError) as e: # probably caught halfway through being saved
+                    print("    can't read "+TOC+": "+str(e))
+                    continue
+                for bookname in books:
+                    if bookname not in snapshots:
+                        snapshots[bookname] = {}
+                for bookname in set(snapshots) - set(books):
+                    del snapshots[bookname]
+                    dropbook(index, bookname)
+                firstchange = firstchange or now
+                lastchange = now
+            for bookname in books:
+                snap = snapshot("src/_"+bookname)
+                if snap != snapshots[bookname]:
+                    snapshots[bookname] = snap
+                    changed.add(bookname)
+                    firstchange = firstchange or now
+                    lastchange = now
+            if firstchange is None or now - lastchange < WATCH_QUIET:
+                continue
+
+            start = time.monotonic()
+            summary = collections.Counter()
+            for bookname in changed:
+                dropbook(index, bookname) # so files deleted from it go away
+            errors = convertbooks([bookname for bookname in books if bookname in changed], pool, jobs, None,
+                                  args.copy_assets, summary, args.cache, index=index)
+            rebuilds += 1
+            if args.cache and rebuilds % WATCH_TRIM == 0:
+                trimcache(args.cache, args.cache_size * 1024 * 1024)
+            done = time.monotonic()
+            print("Rebuilt in %.3fs (%.3fs after the first change): %d files written, %d unchanged, %d removed."
+                  % (done - start, done - firstchange, summary["written"], summary["unchanged"], summary["removed"]))
+            reportlinks(*checklinks(index), reportfname=args.link_report)
+            printerrors(errors)
+            changed = set()
+            firstchange = lastchange = None
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+        if args.cache:
+            trimcache(args.cache, args.cache_size * 1024 * 1024)
+
+def dropbook(index, bookname):
+    """ Takes everything in a book out of the link index """
+    prefix = "src/"+bookname+"/"
+    for path in [path for path in index if path.startswith(prefix)]:
+        del index[path]
+
+def statmtime(fname):
+    """ mtime of fname, or None if it isn't there (right now) """
+    try:
+        return os.stat(fname).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def snapshot(srcdir):
+    """ {path: (size, mtime)} for every file in srcdir, so --watch can tell when something changed """
+    snap = {}
+    for dirname, subdirname, filelist in os.walk(srcdir):
+        for fname in filelist:
+            fname = os.path.join(dirname, fname)
+            try:
+                st = os.stat(fname)
+            except FileNotFoundError: # Flare deleted it while we were looking
+                continue
+            snap[fname] = (st.st_size, st.st_mtime_ns)
+    return snap
+
+def checklinks(index):
+    """
+        Checks every internal link in every topic in index, all in one go once the books are converted.
+        index is {path: manifest entry} for every file in the books (see convertbook), where the path
+        is the file's place on the site: in the converted book dir, under the source's .html name,
+        which is what Jekyll serves the .md as. So a link is just joined onto the path of the topic
+        it's in and looked up. If it has a #fragment, the topic has to have an anchor by that name.
+        A link to something that isn't in index is OK if it's on disk (a Jekyll page that isn't from
+        Flare, or a book that wasn't converted this time), but its anchors can't be checked.
+        Links with a scheme (mailto: and such) or starting with / are skipped.
+        Returns (broken, checked): a list of {topic, href, problem} for the broken links, and how many there were to check.
+    """
+    anchors = {} # made into sets when they're first needed
+    broken = []
+    checked = 0
+    for topic in sorted(index):
+        for href in index[topic].get("links", ()):
+            if SCHEME_RE.match(href) or href.startswith("/"):
+                continue
+            checked += 1
+            path, hash, fragment = href.partition("#")
+            target = topic
+            if path:
+                target = posixpath.normpath(posixpath.join(posixpath.dirname(topic), urllib.parse.unquote(path)))
+            entry = index.get(target)
+            problem = None
+            if entry is None:
+                if not (os.path.exists(target) or target.endswith(".html") and os.path.exists(target[:-len(".html")]+".md")):
+                    problem = "no such topic or file"
+            elif fragment and "mdhash" in entry:
+                if target not in anchors:
+                    anchors[target] = set(entry.get("anchors", ()))
+                if fragment not in anchors[target]:
+                    problem = "no anchor #"+fragment+" in "+target
+            if problem:
+                broken.append({"topic": topic, "href": href, "problem": problem})
+    return broken, checked
+
+def reportlinks(broken, checked, reportfname=None):
+    """ Prints the broken links from checklinks(), and writes them to reportfname (see --link-report) """
+    print("Links: %d checked, %d broken." % (checked, len(broken)))
+    for link in broken:
+        print("    %s: %s (%s)" % (link["topic"], link["href"], link["problem"]))
+    if reportfname:
+        with open(reportfname, "w") as f:
+            json.dump({"checked": checked, "broken": broken}, f, indent=1)
+        print("Link report written to "+reportfname)
+
+def writeprofile(profile, reportfname, slowest=20):
+    """
+        Writes the --profile report: every topic's timings and counts, plus the totals for each rule,
+        slowest topics first. Prints a summary of the slowest ones.
+    """
+    profile.sort(key=lambda p: p["total"], reverse=True)
+    rules = collections.Counter()
+    for p in profile:
+        rules.update(p["rules"])
+    report = {
+        "topics": len(profile),
+        "parse": sum(p["parse"] for p in profile),
+        "convert": sum(p["convert"] for p in profile),
+        "write": sum(p["write"] for p in profile),
+        "inbytes": sum(p["inbytes"] for p in profile),
+        "outbytes": sum(p["outbytes"] for p in profile),
+        "rules": dict(rules.most_common()),
+        "slowest": profile,
+    }
+    with open(reportfname, "w") as f:
+        json.dump(report, f, indent=1)
+
+    print("Profile of %d topics written to %s" % (len(profile), reportfname))
+    print("    parse %.3fs, convert %.3fs, write %.3fs" % (report["parse"], report["convert"], report["write"]))
+    if profile:
+        print("    slowest topics:")
+        print("        total     parse   convert     write     KB in  fragments  depth")
+        for p in profile[:slowest]:
+            print("    %8.3fs %8.3fs %8.3fs %8.3fs %9.1f %10d %6d  %s" % (p["total"], p["parse"], p["convert"], p["write"],
+                                                                  p["inbytes"] / 1024, p["fragments"], p["maxdepth"], p["topic"]))
+        print("    most used rules:")
+        for name, count in rules.most_common(10):
+            print("    %10d  %s" % (count, name))
+
+# The library API: convert_topic(), convert_many() and convert_book(). Import flare_to_md and use
+# these from another program; everything else in here is how the script does it, and may change.
+
+def convert_topic(html):
+    """
+        Converts one Flare topic in memory. html is the clean XHTML, as bytes (or a str).
+        Returns (front_matter, markdown): the front matter as a dict (pageTitle, layout, description),
+        and the markdown that goes after it. The .md the script writes is
+        formatfrontmatter(front_matter)+markdown.
+        Raises ET.ParseError if it isn't well-formed XML.
+    """
+    root = ET.fromstring(html)
+    return frontmatter(root), convertbody(root.find('body'), MarkdownEmitter()).getvalue()
+
+def convert_many(htmls):
+    """
+        convert_topic() for each topic in an iterable, handing back each (front_matter, markdown)
+        as soon as it's done, so there's only ever one topic in memory. The rules are compiled once
+        (see loadrules()) and shared by every topic, so this is all conversion.
+    """
+    for html in htmls:
+        yield convert_topic(html)
+
+def convert_book(src, dst, options=None):
+    """
+        Converts a whole book, incrementally, the way the script does each book in topic.yml:
+        the Flare output in src (src/_<book>) goes to dst (src/<book>).
+        options is a dict, and everything in it is optional:
+            jobs: convert in this many processes (default 1, 0 = one per CPU), see --jobs
+            rules: a rules .yml, see --rules. NOTE: these become the rules for everything
+                converted in this process from then on, not just this book.
+            link_ext: what internal links end in, see --link-ext. Like rules, this sticks.
+            copy_assets: always copy images and other non-topic files, see --copy-assets
+            cache: a cache dir, see --cache
+            cache_size: its size limit in MB, see --cache-size
+            data: write the book's topic list (see writebookdata()) to this file
+            quiet: don't print anything
+        Returns a dict with errors (messages for the topics that couldn't be converted),
+        how many files were written, unchanged and removed, and the broken links in the book
+        (see checklinks()). With a cache, it also has how many topics were cache hits and misses,
+        and how many entries were evicted.
+    """
+    options = options or {}
+    if "rules" in options or "link_ext" in options:
+        loadrules(options.get("rules", RULESFNAME), options.get("link_ext", LINK_EXT))
+    jobs = options.get("jobs", 1) or os.cpu_count() or 1
+    log = print
+    if options.get("quiet"):
+        log = lambda *args: None
+    summary = collections.Counter()
+    pool = None
+    if jobs > 1:
+        pool = startpool(jobs, RULESFNAME, LINK_EXT)
+    index = {}
+    try:
+        errors = convertbook(str(src), str(dst), pool, jobs, None, options.get("copy_assets", False), summary, log,
+                             options.get("cache"), index, options.get("data"))
+    finally:
+        if pool:
+            pool.shutdown()
+    result = {"errors": errors, "written": summary["written"], "unchanged": summary["unchanged"], "removed": summary["removed"],
+              "broken": checklinks(index)[0]}
+    if options.get("cache"):
+        result["hits"] = summary["hit"]
+        result["misses"] = summary["miss"]
+        result["evicted"] = trimcache(options["cache"], options.get("cache_size", 1024) * 1024 * 1024)
+    return result
+
+def convertbook(srcdir, destdir, pool=None, jobs=1, profile=None, copyassets=False, summary=None, log=print, cachedir=None, index=None,
+                datafname=None):
+    """
+        Converts one book from srcdir (src/_<bookname>) to destdir (src/<bookname>).
+        Topics are converted in pool if there is one (see --jobs).
+        Non-topic files are linked instead of copied where possible, unless copyassets.
+        If summary is a Counter, how many output files were written, unchanged and removed get added to it,
+        and how many topics were found in cachedir (hit) or not (miss), if there is a cache (see --cache).
+        If profile is a list, timings and counts for each topic converted get added to it (see --profile).
+        If index is a dict, every file in the book gets added to it (see checklinks()).
+        If there's a datafname, the book's topic list is written there (see writebookdata()).
+        Everything it has to say goes to log (print, unless you're using it as a library).
+        Returns a list of error messages for topics that couldn't be converted.
+    """
+
+    # Recursively copy everything in src/_topic dir to src/topic.
+    #TODO: (check if src/_topic really contains raw xhtml output and isn't a dir in a dir, etc)
+    #TODO: at bare minimum, it needs an index.html in the root
+
+    #old way:
+    #if the destination dir already exists, delete it
+    #TODO: shutil.copytree doesn't clobber files, so I have to delete the old dir first.
+    # There's a performance hit because you have to re-copy everything each run, so rethink this later?
+    # if os.path.isdir("src/"+bookname):
+    #     shutil.rmtree("src/"+bookname)
+    # try:
+    #     shutil.copytree("src/_"+bookname,"src/"+bookname) #these paths are probably kludgy
+    # except shutil.Error as e:
+    #     print('Directory not copied. Error: %s' % e)
+    # except OSError as e:
+    #     print('Directory not copied. Error: %s' % e)
+
+    #newer way: copy_tree("src/_"+bookname,"src/"+bookname), then convert every topic. That
+    # re-copied and re-converted the whole book on every run.
+
+    #current way: the manifest in src/<book>/.flare-manifest.json remembers the size, mtime and
+    # hash of every source file, plus the output it made. Only new or changed files get looked at,
+    # and outputs for files that went away get removed.
+    # Topics are read straight out of src/_<book> and only the .md is written to src/<book>
+    # (it used to copy the .html over, convert it, then delete it). Everything else is hard linked
+    # (or reflinked, or copied if neither works) by syncfile().
+    manifest = loadmanifest(destdir)
+    files = manifest["files"]
+    if not os.path.isdir(srcdir):
+        # a typo in topic.yml, or the export being swapped out: that's not every topic being deleted,
+        # so leave the converted book (and the link index) as it was
+        log("    ERROR: "+str(srcdir)+" isn't there (or isn't a directory)")
+        if index is not None:
+            base = Path(destdir).as_posix()
+            for relname, entry in files.items():
+                index[base+"/"+relname] = entry
+        return [str(srcdir)+": no such directory, nothing converted or removed"]
+    seen = set()
+    todo = []
+    errors = []
+    synced = collections.Counter()
+    counts = collections.Counter()
+    dirty = False # the manifest only gets saved if something in it changed
+
+    try:
+        # Plain strings, not Paths, up to where a file turns out to need work: most of them don't,
+        # and then this loop is most of the run.
+        skip = len(os.path.join(srcdir, ""))
+        #  For each file recursively in the whole dirtree:
+        for dirname, subdirname, filelist in os.walk(srcdir):
+            reldir = dirname[skip:].replace(os.sep, "/")
+            destdirname = os.path.join(destdir, reldir)
+            try:
+                # one listdir per dir instead of a stat per file, to see if the outputs are still there
+                outputs = set(os.listdir(destdirname))
+            except FileNotFoundError:
+                outputs = set()
+            for fname in filelist:
+                srcfname = os.path.join(dirname, fname)
+                relname = reldir+"/"+fname if reldir else fname
+                try:
+                    st = os.stat(srcfname)
+                except FileNotFoundError: # Flare deleted it while we were looking: as if it was never there
+                    continue
+                seen.add(relname)
+
+                if fname.endswith(".html"):  # or .htm? or both?
+                    outname = fname[:-len(".html")]+".md"
+                else:
+                    outname = fname
+
+                # Same size and mtime as last time: don't even read it
+                entry = files.get(relname)
+                if entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime_ns and outname in outputs:
+                    counts["unchanged"] += 1
+                    continue
+                # Touched but not changed (Flare re-exports everything): just remember the new mtime
+                try:
+                    digest = hashfile(srcfname)
+                except FileNotFoundError:
+                    seen.discard(relname)
+                    continue
+                if entry and entry["hash"] == digest and outname in outputs:
+                    entry["size"] = st.st_size
+                    entry["mtime"] = st.st_mtime_ns
+                    counts["unchanged"] += 1
+                    dirty = True
+                    continue
+
+                outfname = Path(destdirname) / outname
+                outfname.parent.mkdir(parents=True, exist_ok=True)
+                entry = {"size": st.st_size, "mtime": st.st_mtime_ns, "hash": digest,
+                         "output": reldir+"/"+outname if reldir else outname}
+
+                if fname.endswith(".html"):
+                    # topics get converted below, all at once, so they can be spread over a pool.
+                    # It only goes in the manifest once it has converted OK.
+                    todo.append((relname, entry))
+                else:
+                    # If it's anything other than a .html, it's just linked/copied, no processing
+                    # (if there's any other creative pruning we need to do, do it here)
+                    #TODO: not important, but we could drop *.mclog probably
+                    try:
+                        how = syncfile(srcfname, outfname, st, copyassets)
+                    except FileNotFoundError:
+                        seen.discard(relname)
+                        continue
+                    synced[how] += 1
+                    counts["unchanged" if how == "unchanged" else "written"] += 1
+                    files[relname] = entry
+                    dirty = True
+
+        # You parse the .html in src/_<book>, and write the .md to src/<book>
+        # Sorted so the log comes out in the same order no matter how many jobs there are.
+        todo.sort(key=lambda t: t[0])
+        htmlfnames = [str(Path(srcdir) / relname) for relname, entry in todo]
+        mdfnames = [str(Path(destdir) / entry["output"]) for relname, entry in todo]
+        profiling = [profile is not None] * len(todo)
+        cachefnames = [cachedir and cachepath(cachedir, entry["hash"]) for relname, entry in todo]
+        if pool:
+            # chunks, so tiny topics don't spend all their time going back and forth to the workers
+            chunksize = max(1, min(64, len(todo) // (jobs * 4)))
+            results = pool.map(convertfile, htmlfnames, mdfnames, profiling, cachefnames, chunksize=chunksize)
+        else:
+            results = map(convertfile, htmlfnames, mdfnames, profiling, cachefnames)
+        # pool.map hands the results back in order, so this prints in order too
+        for (relname, entry), htmlfname, result in zip(todo, htmlfnames, results):
+            log(htmlfname)
+            if "error" in result:
+                log("    ERROR: "+result["error"])
+                errors.append(htmlfname+": "+result["error"])
+            else:
+                entry["mdhash"] = result["mdhash"]
+                # the link checker and the data file need these for every topic, not just the ones converted this time
+                for key in TOPIC_INFO:
+                    if result.get(key):
+                        entry[key] = result[key]
+                files[relname] = entry
+                counts["written" if result["written"] else "unchanged"] += 1
+                dirty = True
+                if "cache" in result:
+                    counts[result["cache"]] += 1
+            if profile is not None and "profile" in result:
+                result["profile"]["topic"] = htmlfname
+                profile.append(result["profile"])
+
+        # Anything in the manifest that isn't in the source anymore was deleted in Flare,
+        # so get rid of whatever it turned into.
+        for relname in sorted(set(files) - seen):
+            outfname = Path(destdir) / files[relname]["output"]
+            if outfname.exists():
+                log("removing "+str(outfname))
+                os.remove(outfname)
+                counts["removed"] += 1
+            del files[relname]
+            dirty = True
+    finally:
+        # save even if something blew up, so the topics that did get done aren't redone
+        if dirty:
+            savemanifest(destdir, manifest)
+    # it's made from the manifest, so it can only be out of date if the manifest changed
+    if datafname and (dirty or not os.path.exists(datafname)) and writebookdata(datafname, Path(destdir).name, files):
+        log("    wrote "+str(datafname))
+    if synced:
+        log("    other files: "+", ".join("%d %s" % (n, how) for how, n in sorted(synced.items())))
+    log("    %d written, %d unchanged, %d removed" % (counts["written"], counts["unchanged"], counts["removed"]))
+    if cachedir and (counts["hit"] or counts["miss"]):
+        log("    cache: %d hits, %d misses" % (counts["hit"], counts["miss"]))
+    if summary is not None:
+        summary.update(counts)
+    if index is not None:
+        base = Path(destdir).as_posix()
+        for relname, entry in files.items():
+            index[base+"/"+relname] = entry
+    return errors
+
+def writebookdata(datafname, bookname, files):
+    """
+        Writes the list of topics in a book to datafname (src/_data/flare/<book>.json), so the TOC and search
+        can be made from one file instead of reading every page. For each topic: path (of the .md, the way Jekyll's
+        page.path has it), title, description, headings ({level, text}) and words. It all comes from the manifest
+        entries (files), so only the topics that changed had to be converted to get it, and the file is only
+        written if it changed. One topic per line, so it diffs nicely.
+        Returns True if it was written.
+    """
+    topics = []
+    for relname, entry in sorted(files.items()):
+        if "mdhash" not in entry: # not a topic
+            continue
+        topics.append({"path": bookname+"/"+entry["output"],
+                       "title": entry.get("title", ""),
+                       "description": entry.get("description", ""),
+                       "headings": entry.get("headings", []),
+                       "words": entry.get("words", 0)})
+    Path(datafname).parent.mkdir(parents=True, exist_ok=True)
+    return writeifchanged(datafname, "[\n"+",\n".join(json.dumps(topic, separators=(",", ":")) for topic in topics)+"\n]\n")
+
+def syncfile(srcfname, destfname, st, copyonly=False):
+    """
+        Makes destfname the same as srcfname (whose os.stat is st), for anything that isn't a topic.
+        Leaves it alone if it's already the same size and mtime. Otherwise hard links it, or if that
+        doesn't work (different drive, filesystem can't), reflinks it (copy-on-write, btrfs/xfs on Linux),
+        or if that doesn't work either, copies it. copyonly skips straight to copying.
+        NOTE: with a hard link, src/<book>/x.png IS src/_<book>/x.png, so don't edit it in place.
+        Returns what it did: "unchanged", "linked", "reflinked" or "copied".
+    """
+    try:
+        destst = os.stat(destfname)
+        if destst.st_size == st.st_size and destst.st_mtime_ns == st.st_mtime_ns:
+            return "unchanged"
+        os.remove(destfname)
+    except FileNotFoundError:
+        pass
+    if not copyonly:
+        try:
+            os.link(srcfname, destfname)
+            return "linked"
+        except OSError:
+            pass
+        if reflink(srcfname, destfname):
+            return "reflinked"
+    shutil.copy2(srcfname, destfname)
+    return "copied"
+
+def reflink(srcfname, destfname):
+    """ Makes destfname a copy-on-write clone of srcfname. Returns False if the OS or filesystem can't. """
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+    try:
+        with open(srcfname, "rb") as s, open(destfname, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    except OSError:
+        if os.path.exists(destfname):
+            os.remove(destfname)
+        return False
+    shutil.copystat(srcfname, destfname)
+    return True
+
+def convertfile(htmlfname, mdfname, profile=False, cachefname=None):
+    """
+        Converts one topic: parses the .html, writes the .md.
+        Returns a dict with mdhash and written (False if the .md was already exactly that),
+        or error if it couldn't be converted. This is what runs in the worker processes with --jobs,
+        so a bad topic hands back its error instead of raising and taking the whole book down.
+        If profile, the dict also has profile: timings and counts for the topic (see --profile).
+        The dict also has the anchors and links in the topic, for checklinks().
+        If there's a cachefname (see cachepath()), the .md (and the rest of the dict) comes from there
+        if it's in the cache, instead of converting the topic at all, or is put there once it's converted,
+        and the dict has cache: "hit" or "miss".
+    """
+# TODO: check that the name isn't weird: spaces, trademark symbols, whatever
+    # write it back out, but to .md file. The markdown is streamed into a temp file as it's made
+    # and only renamed over the .md once the whole topic is done, so a topic that blows up
+    # halfway doesn't leave half a page behind. If the .md is already exactly the same, it's
+    # left alone, so its mtime doesn't change and Jekyll doesn't regenerate it.
+    tmpfname = mdfname+".tmp"
+    try:
+        result = None
+        if cachefname:
+            result = cacheget(cachefname, tmpfname)
+        if result:
+            result["cache"] = "hit"
+        else:
+            info = {}
+            if profile:
+                result = profilefile(htmlfname, tmpfname, info)
+            else:
+                with open(tmpfname, "w") as text_file:
+                    md = converttopic(htmlfname, MarkdownEmitter(text_file), info)
+                result = {"mdhash": md.hexdigest()}
+            result.update(info)
+            if cachefname:
+                cacheput(cachefname, tmpfname, result)
+                result["cache"] = "miss"
+        result["written"] = replaceifchanged(tmpfname, mdfname)
+    except Exception as e:
+        if os.path.exists(tmpfname):
+            os.remove(tmpfname)
+        return {"error": "%s: %s" % (type(e).__name__, e)}
+    return result
+
+def replaceifchanged(tmpfname, fname):
+    """
+        Renames tmpfname over fname, unless fname already has exactly the same contents,
+        in which case tmpfname is deleted and fname isn't touched.
+        Returns True if fname was written.
+    """
+    try:
+        if os.path.getsize(fname) == os.path.getsize(tmpfname) and samecontents(tmpfname, fname):
+            os.remove(tmpfname)
+            return False
+    except FileNotFoundError:
+        pass
+    os.replace(tmpfname, fname)
+    return True
+
+def writeifchanged(fname, text):
+    """ Writes text to fname (through a temp file and a rename), unless it already has exactly that in it. Returns True if it wrote it. """
+    tmpfname = str(fname)+".tmp"
+    with open(tmpfname, "w") as f:
+        f.write(text)
+    return replaceifchanged(tmpfname, fname)
+
+def samecontents(fname1, fname2):
+    """ True if two files have the same bytes in them. (filecmp.cmp caches every answer forever.) """
+    with open(fname1, "rb") as f1, open(fname2, "rb") as f2:
+        while True:
+            b1 = f1.read(65536)
+            b2 = f2.read(65536)
+            if b1 != b2:
+                return False
+            if not b1:
+                return True
+
+def cachepath(cachedir, digest):
+    """
+        Where the converted topic whose source has this sha256 lives in the cache (see --cache).
+        The key has the converter version and the rules in it too, so if either changes
+        the old entries just stop getting hits, and get evicted eventually.
+    """
+    key = hashlib.sha256(("%s\n%s\n%s" % (CONVERTER_VERSION, RULESET_ID, digest)).encode("utf-8")).hexdigest()
+    return os.path.join(cachedir, key[:2], key+".json")
+
+def cacheget(cachefname, destfname):
+    """
+        Writes the .md in a cache entry to destfname, and touches the entry if it can, since trimcache() throws
+        out the least recently used ones. Returns the rest of what convertfile() found out about the
+        topic (see cacheput), or None if it isn't in the cache.
+    """
+    try:
+        with open(cachefname) as f:
+            cached = json.load(f)
+    except (FileNotFoundError, ValueError): # not there, or another build just evicted it
+        return None
+    try:
+        os.utime(cachefname)
+    except OSError: # someone else's entry (a shared cache): still a hit, it just doesn't get younger
+        pass
+    with open(destfname, "w") as text_file:
+        text_file.write(cached.pop("md"))
+    return cached
+
+def cacheput(cachefname, mdfname, result):
+    """
+        Puts a converted topic in the cache: the .md in mdfname, plus what convertfile() found out about
+        it in result (but not the --profile timings, those are only for this run).
+        The cache can be shared by builds running at the same time, so it's written to a temp file
+        of our own and renamed into place: anyone reading it gets the whole thing or nothing.
+        A cache that can't be written to just doesn't cache anything.
+    """
+    cached = {key: value for key, value in result.items() if key != "profile"}
+    with open(mdfname) as text_file:
+        cached["md"] = text_file.read()
+    tmpfname = "%s.%d.tmp" % (cachefname, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cachefname), exist_ok=True)
+        with open(tmpfname, "w") as f:
+            json.dump(cached, f)
+        os.replace(tmpfname, cachefname)
+    except OSError:
+        if os.path.exists(tmpfname):
+            os.remove(tmpfname)
+
+def trimcache(cachedir, maxbytes):
+    """
+        Deletes the least recently used cache entries (the oldest mtime, since a hit touches it)
+        until the cache is no bigger than maxbytes. Returns how many were deleted.
+    """
+    entries = []
+    total = 0
+    now = time.time()
+    for dirname, subdirs, fnames in os.walk(cachedir):
+        for fname in fnames:
+            fname = os.path.join(dirname, fname)
+            try:
+                st = os.stat(fname)
+            except FileNotFoundError: # another build got it first
+                continue
+            # someone else's half-written entry. Old ones are left over from a crash, and can go.
+            if fname.endswith(".tmp") and now - st.st_mtime < 3600:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, fname))
+            total += st.st_size
+    entries.sort()
+    evicted = 0
+    for mtime, size, fname in entries:
+        if total <= maxbytes:
+            break
+        try:
+            os.remove(fname)
+        except OSError:
+            continue
+        total -= size
+        evicted += 1
+    return evicted
+
+def profilefile(htmlfname, mdfname, info):
+    """
+        What convertfile does with --profile: the same conversion, but parse, convert and write
+        are done one after the other (instead of streaming) so each can be timed.
+    """
+    stats = {"inbytes": os.path.getsize(htmlfname)}
+    start = time.perf_counter()
+    root = ET.parse(htmlfname).getroot()
+    parsed = time.perf_counter()
+    if CPROFILE:
+        CPROFILE.enable()
+    md = convertroot(root, stats=stats, info=info)
+    if CPROFILE:
+        CPROFILE.disable()
+    converted = time.perf_counter()
+    mdout = md.getvalue()
+    with open(mdfname, "w") as text_file:
+        text_file.write(mdout)
+    written = time.perf_counter()
+    stats["outbytes"] = len(mdout.encode("utf-8"))
+    stats["parse"] = parsed - start
+    stats["convert"] = converted - parsed
+    stats["write"] = written - converted
+    stats["total"] = written - start
+    return {"mdhash": md.hexdigest(), "profile": stats}
+
+def converttopic(htmlfname, md=None, info=None):
+    """
+        Converts one Flare topic to markdown.
+        Returns a MarkdownEmitter with the whole .md file contents (yaml front matter and all),
+        md.getvalue() gets it as a string. Pass in a MarkdownEmitter on an open file to write it
+        straight to the file instead. See convertroot() for info.
+    """
+    return convertroot(ET.parse(htmlfname).getroot(), md, info=info)
+
+def convertroot(root, md=None, stats=None, info=None):
+    """
+        Same as converttopic(), but for a topic that's already been parsed (root is the <html> element).
+        If stats is a dict, fragments (how many tags and bits of text there were), maxdepth (deepest
+        the tags got) and rules (how many times each rule was used) get put in it, for --profile.
+        If info is a dict, what the link checker and the book's data file need to know about the topic
+        gets put in it: anchors (the id/name of everything that has one), links (the href of every internal
+        link), title and description (same as the front matter), headings ({level, text} for each one)
+        and words (roughly how many words of text there are).
+    """
+    if md is None:
+        md = MarkdownEmitter()
+    fm = frontmatter(root)
+    if info is not None:
+        info["title"] = fm["pageTitle"]
+        info["description"] = fm["description"]
+    #glue yaml lines to start of body string, with linebreaks
+    md.write(formatfrontmatter(fm))
+    md.flush()
+    return convertbody(root.find('body'), md, stats, info)
+
+def frontmatter(root):
+    """ The Jekyll front matter for a topic (root is the <html> element), as a dict """
+    # Getting Stuff For The YAML
+# TODO: only title is really required. The others may be in the head, so look there and skip if missing
+    # - get <title>, clean it up, and make it the pageTitle
+    pageTitle = cleanelement(root.find('head/title'))
+    # - get the first p contents, clean it up, and make it the description.
+    description = cleanelement(root.find('body/p'))
+    #TODO: both of these could fail because of missing elements
+    #TODO: no navtitle - I hope we don't get any crazy TOC titles out of this
+    #TODO: someday figure out keywords
+    return {"pageTitle": pageTitle, "layout": "page-with-toolbar", "description": description}
+
+def formatfrontmatter(fm):
+    """ The front matter dict as the --- block at the top of the .md. cleanelement() already made the values yaml-safe. """
+    return "---\n"+"".join(key+": "+value+"\n" for key, value in fm.items())+"---\n"
+
+def convertbody(bod, md, stats=None, info=None):
+    """ Converts everything in <body> (but not the <body></body> tags) into md. Returns md. See convertroot() for stats and info. """
+    # Walk everything within <body> straight off the parsed tree.
+    # This used to ET.tostring() every child, glue it into one giant line, put a \n around every
+    # tag with a regex, split it again and regex every piece to see if it was an open/close/void tag.
+    # walkbody() hands back the same pieces (tags exactly as ET.tostring writes them, text with the
+    # line breaks stripped out) and says what they are, without the round trip.
+
+    # Here are the cases handled in the conversion:
+    # 0. Void tags (<br/>, <img * />, etc) are passed through.
+    # 1. <h1>-<h4> become "# " - "#### "
+    # 2. <p> becomes a blank line (except as follows)
+    # 2a. <p></p> inside tables are preserved
+    # 2b. <p class="*"> gets prepended with "    " per list level for the following class values:
+    #     "left"
+    #     "code" - also gets wrapped in a <code> tag.
+    #     "Caption" - also gets wrapped in ***bolditalic***
+    #     "centered"
+    #     "SeeItem" - also prepented with a bullet
+    # 3. <div*> becomes a blank line NOTE: this kills all divs, including note, tip, etc.
+    # 4. <ul*> and <ol*> become a blank line
+    # 5. A <li> becomes either "1. " or "#. " depending on if it is inside a ul or li
+    # 5a. Also gets prepended with "    " per list level above one, so it is properly nested.
+    # NOTE: our CSS might not handle lists more than two levels deep, but this script does.
+    # 6. Internal links (no http* at the start) not inside tables are converted to markdown links:
+    #   old: <a href="hello/index.html">link text</a>
+    #   new: [link text](./hello/index.html) - note no line break after
+    # NOTE: this assumes no ./ in front of the links in Flare
+    # 7. </h1>-</h4> become two linebreaks
+    # 8. </p>,</div>,</ul>,</ol>,</li>,all become a single line break
+    # 9. <span> behavior:
+    #   class="blue" replaced with <span style="color:blue">
+    #   class="red" replaced with <span style="color:red">
+    #   if inside a table:
+    #       class="b" becomes <b>, class="i" becomes <i>, class="code" becomes <code>
+    #   if outside a table:
+    #       same as above but with md tags  **b** *i*. class="code" also becomes <code>
+    #   All other spans are dropped
+    # 10. Everything else is passed through, with all original linebreaks stripped out
+    # 11. Nested tags inside an anchor are properly converted.
+    #
+
+    # The TODO list: (last modified 5/10/20):
+    # * bulleted lists inside tables aren't converted, and end up being random unicode bullet characters with no list form.
+    # <span*> tags are dropped, but should be implemented. i.e. <span class="b">foo</span> becomes **foo**
+    # * all divs are removed, and there could be a more graceful way of handling that.
+
+    # What each tag turns into lives in RULES now (see DEFAULT_RULES), looked up once per tag
+    # on (tag, class, in a table?). tag_stack holds a TagRecord (tag, class, rule) for each
+    # open tag, so the close tag does whatever its open tag's rule says.
+    # Nothing scans the stack anymore: table_depth counts the tables we're in, and list_kinds
+    # is "ul"/"ol" for each list we're in (so its length is the list depth, for indenting).
+    # anchor_stack has the open tag of each anchor we're in, since the link is made at </a>.
+    # The output goes through md (see MarkdownEmitter): write() is what used to be added to
+    # tmp_guts, flush() is what used to move tmp_guts onto newbody.
+    tag_stack = []
+    list_kinds = []
+    anchor_stack = []
+    table_depth = 0
+    write = md.write
+    flush = md.flush
+    fragments = 0
+    maxdepth = 0
+    hits = collections.Counter() if stats is not None else None
+    anchors = links = headings = None
+    words = 0
+    if info is not None:
+        anchors = info["anchors"] = []
+        links = info["links"] = []
+        headings = info["headings"] = []
+    for kind, line, ele in walkbody(bod):
+        fragments += 1
+        # print("line: "+line)
+        # print(tag_stack)
+        # print("   ")
+        if kind == VOID: # void tag such as <br/> or <img/>
+            # TODO also matches <p/> and it's passing those, which might not be right
+            write(line) #TODO: you might want a \n if it's not in a list
+            if anchors is not None and ele.attrib:
+                addanchors(ele, anchors) # <a name="bookmark"/>
+        elif kind == OPEN:
+            if anchors is not None and ele.attrib:
+                addanchors(ele, anchors)
+            rec = tagrecord(ele, table_depth > 0)
+            tag_stack.append(rec)
+            if headings is not None and rec.tag in HEADING_TAGS:
+                headings.append({"level": int(rec.tag[1]), "text": " ".join("".join(ele.itertext()).split())})
+            if len(tag_stack) > maxdepth:
+                maxdepth = len(tag_stack)
+            if hits is not None:
+                hits[rec.rule.name] += 1
+            if rec.tag == "table":
+                table_depth += 1
+            elif rec.tag == "ul" or rec.tag == "ol":
+                list_kinds.append(rec.tag)
+            rule = rec.rule
+            if rule.capture:
+                # an anchor: keep it on the stack, deal with it at tag close
+                anchor_stack.append(line)
+                md.startcapture()
+            else:
+                write(filltemplate(rule.open, line, list_kinds))
+        elif kind == CLOSE:
+            rec = tag_stack.pop()
+            if rec.tag == "table":
+                table_depth -= 1
+            elif rec.tag == "ul" or rec.tag == "ol":
+                list_kinds.pop()
+            rule = rec.rule
+            if rule.capture:
+                #need to deal with a link here
+                anchor_guts = md.endcapture()
+                anchor_base = anchor_stack.pop()
+                href = HREF_RE.search(anchor_base)
+                #external link (or no link at all), leave it alone
+                if not href or re.search("\"http",anchor_base):
+                    write(anchor_base+anchor_guts+line)
+                else:
+                    #NOTE: this assumes no ./ in front of the links in Flare
+                    write(filltemplate(rule.close, line, list_kinds, anchor_guts, relink(href.group(1))))
+                    if links is not None:
+                        links.append(ele.get("href"))
+            else:
+                write(filltemplate(rule.close, line, list_kinds))
+            # this runs after any close tag. Does nothing if we're still in an anchor.
+            flush()
+        else: #text between tags aka "guts"
+            write(line)
+            if info is not None:
+                words += len(ele.split()) # ele is the raw text, see walkbody()
+
+    if info is not None:
+        info["words"] = words
+    if stats is not None:
+        stats["fragments"] = fragments
+        stats["maxdepth"] = maxdepth
+        stats["rules"] = dict(hits)
+    return md
+
+def addanchors(ele, anchors):
+    """ Adds the id and name of an element, if it has them, to anchors: they're what a #fragment in a link can point at """
+    ident = ele.get("id")
+    if ident:
+        anchors.append(ident)
+    name = ele.get("name")
+    if name and name != ident:
+        anchors.append(name)
+
+def relink(href):
+    """ Changes the .html on the end of an internal link to LINK_EXT (see --link-ext) """
+    if LINK_EXT == ".html":
+        return href
+    path, hash, fragment = href.partition("#")
+    if path.endswith(".html"):
+        path = path[:-len(".html")]+LINK_EXT
+    return path+hash+fragment
+
+class MarkdownEmitter:
+    """
+        Where the converted markdown goes. write() adds to the pending text, and flush() moves
+        the pending text to the output. Everything is kept as a list of pieces and joined once,
+        instead of adding strings together over and over, which got really slow (every += copies
+        the whole thing) on the big API reference topics.
+
+        An anchor's text is held in its own buffer: startcapture() at <a>, and endcapture() at </a>
+        hands back everything written since, so it can be made into a link. flush() doesn't do
+        anything while there's a capture going, so nested tags inside an anchor stay inside it.
+
+        If out is an open file, flushed text is written straight to it instead of being kept,
+        so the topic is never all in memory at once. Pending text that never gets flushed
+        (anything after the last close tag in the body) is dropped, same as it always was.
+    """
+    def __init__(self, out=None):
+        self.out = out
+        self.chunks = []
+        self.pending = []
+        self.captures = []
+        self.sha = hashlib.sha256() if out else None
+
+    def write(self, s):
+        if s:
+            self.pending.append(s)
+
+    def flush(self):
+        if self.captures or not self.pending:
+            return
+        text = "".join(self.pending)
+        self.pending = []
+        if self.out:
+            self.out.write(text)
+            self.sha.update(text.encode("utf-8"))
+        else:
+            self.chunks.append(text)
+
+    def startcapture(self):
+        self.flush()
+        self.captures.append(self.pending)
+        self.pending = []
+
+    def endcapture(self):
+        text = "".join(self.pending)
+        self.pending = self.captures.pop()
+        return text
+
+    def getvalue(self):
+        """ All the flushed output, as one string (not for file output, that's already in the file) """
+        return "".join(self.chunks)
+
+    def hexdigest(self):
+        """ sha256 of all the flushed output """
+        if self.sha:
+            return self.sha.hexdigest()
+        return hashlib.sha256(self.getvalue().encode("utf-8")).hexdigest()
+
+def walkbody(bod):
+    """
+        Walks the children of <body> in document order, yielding (kind, fragment, element):
+            OPEN, '<p class="code">'
+            VOID, '<br />'  (an element with no text and no children, which is how ET writes them)
+            TEXT, 'some text'  (escaped like ET does, with any line breaks and the spaces around them removed)
+            CLOSE, '</p>'
+        For text, the element is the text as it was, before the escaping and line break removal (so words
+        on either side of a line break are still two words). Text that ends up empty isn't yielded. The text right inside <body> is skipped, same as before.
+    """
+    todo = [(iter(bod), None)]
+    while todo:
+        children, parent = todo[-1]
+        ele = next(children, None)
+        if ele is None:
+            todo.pop()
+            if parent is not None:
+                yield CLOSE, "</"+parent.tag+">", parent
+                if parent.tail:
+                    text = flattentext(parent.tail)
+                    if text:
+                        yield TEXT, text, parent.tail
+            continue
+
+        tag = "<"+ele.tag
+        for name, value in ele.items():
+            tag += " "+name+"=\""+escapeattrib(value)+"\""
+        if ele.text or len(ele):
+            yield OPEN, tag+">", ele
+            if ele.text:
+                text = flattentext(ele.text)
+                if text:
+                    yield TEXT, text, ele.text
+            todo.append((iter(ele), ele))
+        else:
+            yield VOID, tag+" />", ele
+            if ele.tail:
+                text = flattentext(ele.tail)
+                if text:
+                    yield TEXT, text, ele.tail
+
+def flattentext(s):
+    """
+        Escapes text the way ET.tostring does (&, <, > and anything non-ascii as &#NNN;)
+        and strips out line breaks and the whitespace around them.
+    """
+    if "&" in s:
+        s = s.replace("&", "&amp;")
+    if "<" in s:
+        s = s.replace("<", "&lt;")
+    if ">" in s:
+        s = s.replace(">", "&gt;")
+    if not s.isascii():
+        s = s.encode("ascii", "xmlcharrefreplace").decode("ascii")
+    if "\n" in s:
+        s = LINEBREAK_RE.sub("", s)
+    return s
+
+def escapeattrib(s):
+    """ Escapes an attribute value the way ET.tostring does """
+    if "&" in s:
+        s = s.replace("&", "&amp;")
+    if "<" in s:
+        s = s.replace("<", "&lt;")
+    if ">" in s:
+        s = s.replace(">", "&gt;")
+    if '"' in s:
+        s = s.replace('"', "&quot;")
+    if "\r" in s:
+        s = s.replace("\r", "&#13;")
+    if "\n" in s:
+        s = s.replace("\n", "&#10;")
+    if "\t" in s:
+        s = s.replace("\t", "&#09;")
+    if not s.isascii():
+        s = s.encode("ascii", "xmlcharrefreplace").decode("ascii")
+    return s
+
+def compilerules(rules):
+    """
+        Turns a list of rules (see DEFAULT_RULES) into the lookup table findrule() uses:
+        {(tag, class or None, intable): Rule}. Templates are split up here, once,
+        so filltemplate() doesn't have to parse them for every tag.
+    """
+    table = {}
+    for r in rules:
+        if "tag" not in r:
+            raise ValueError("rule has no tag: "+repr(r))
+        # the name is just for --profile, e.g. "span.b (table)"
+        name = r["tag"]
+        if r.get("class") is not None:
+            name += "."+r["class"]
+        if "table" in r:
+            name += " (table)" if r["table"] else " (not table)"
+        rule = Rule(compiletemplate(r.get("open", "")), compiletemplate(r.get("close", "")), bool(r.get("capture")), name)
+        if "table" in r:
+            wheres = [bool(r["table"])]
+        else:
+            wheres = [True, False]
+        for intable in wheres:
+            table[(r["tag"], r.get("class"), intable)] = rule
+    return table
+
+def compiletemplate(template):
+    """
+        Returns the template as a plain string if it has no {fields} in it (which is most of them),
+        otherwise a list of (literal text, field name or None) pieces.
+    """
+    parts = []
+    for literal, field, spec, conv in string.Formatter().parse(template):
+        if field is not None and field not in TEMPLATE_FIELDS:
+            raise ValueError("unknown field {"+field+"} in rule template "+repr(template))
+        parts.append((literal, field))
+    if all(field is None for literal, field in parts):
+        return "".join(literal for literal, field in parts)
+    return parts
+
+def loadrules(rulesfname=None, linkext=".html"):
+    """
+        Sets up RULES from DEFAULT_RULES, plus the rules in rulesfname (a yaml list) if there is one.
+        Rules from the file win over the defaults for the same tag/class/table.
+        linkext is what internal links to .html topics end in (see --link-ext).
+        Also run at the start of each --jobs worker, so they get the same rules.
+    """
+    global RULES, RULESET_ID, TAGRECORDS, RULESFNAME, LINK_EXT
+    # so convert_book() can start its workers with the same rules
+    RULESFNAME = rulesfname
+    LINK_EXT = linkext
+    rules = list(DEFAULT_RULES)
+    if rulesfname:
+        with open(rulesfname) as f:
+            rules += yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader)) or []
+    RULES = compilerules(rules)
+    TAGRECORDS = {} # see tagrecord()
+    # the manifest remembers this, so changing the rules converts everything again
+    RULESET_ID = hashlib.sha256(json.dumps({"rules": rules, "linkext": linkext}, sort_keys=True).encode("utf-8")).hexdigest()
+
+def findrule(tag, cls, intable):
+    """ Returns the Rule for an element. Most specific first: tag+class, then just the tag. """
+    rule = RULES.get((tag, cls, intable))
+    if rule is None:
+        rule = RULES.get((tag, None, intable))
+    if rule is None:
+        rule = PASSTHROUGH._replace(name=tag+" (no rule)")
+    return rule
+
+def tagrecord(ele, intable):
+    """
+        Returns the TagRecord for an element: (tag, class, rule).
+        There's only ever one record for each tag/class/table combination, shared by every
+        topic, so the stack is just pointers to a handful of tuples and the rule is only looked up once.
+    """
+    key = (ele.tag, ele.get("class"), intable)
+    rec = TAGRECORDS.get(key)
+    if rec is None:
+        tag = sys.intern(key[0])
+        cls = key[1] and sys.intern(key[1])
+        rec = TAGRECORDS[key] = TagRecord(tag, cls, findrule(tag, cls, intable))
+    return rec
+
+def filltemplate(template, line, list_kinds, guts="", href=""):
+    """ Fills in a compiled template (see compiletemplate) for the tag in line """
+    if template.__class__ is str:
+        return template
+    out = ""
+    for literal, field in template:
+        out += literal
+        if field == "tag":
+            out += line
+        elif field == "indent":
+            out += getIndent(len(list_kinds),1)
+        elif field == "listindent":
+            # determines list depth and adds four spaces per depth-1 before li
+            # i.e. a depth=1 gets no spaces
+            out += getIndent(len(list_kinds),0)
+        elif field == "bullet":
+            # determine if this should be ordered or unordered, from the list the <li> is in
+            if list_kinds and list_kinds[-1] == "ul":
+                out += "* "
+            else:
+                out += "1. "
+        elif field == "guts":
+            out += guts
+        elif field == "href":
+            out += href
+    return out
+
+def getIndent(list_depth,margin):
+    """
+        pass how many lists deep we are, and margin
+        returns four spaces per list level, for proper indenting:
+        0 = an <li> which adds 4 spaces per depth-1
+        1 = a pclass which adds 4 spaces per depth
+    """
+    return "    " * max(list_depth + margin - 1, 0)
+
+def tagName(fulltag):
+    tag = re.search("</*\s*(\w+)",fulltag).group(1)
+    return tag
+
+def cleanelement(ele):
+    # Do other stuff to make strings yaml-safe
+    # Current replacements:
+    #   * chop trailing spaces
+    #   * \n converted to a space (every element had a \n and eight spaces at the end for some reason)
+    #   * ":" converted to a "-"
+    #   * &#8482; - convert to nothing
+    #   * &#160; - convert to a space
+    #   * &#174; - convert to nothing
+
+    s = ET.tostring(ele, method='text').decode("utf-8").rstrip().replace('\n',' ').replace(':','-').replace('&#160;',' ').replace('&#8482;','').replace('&#174;','')
+    return s
+
+PASSTHROUGH = Rule(compiletemplate("{tag}"), compiletemplate("{tag}"), False, "(no rule)")
+loadrules()
+
+def hashfile(fname):
+    """ sha256 of a file's contents, as a hex string """
+    h = hashlib.sha256()
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(1024*1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def loadmanifest(destdir):
+    """
+        Returns the manifest from the last run for a converted book dir.
+        Returns an empty one if there isn't one, it's unreadable, or it's from another converter version
+        or set of rules.
+        manifest["files"] is keyed on the source path relative to src/_<book>, and each entry has:
+            size, mtime (ns), hash: of the source file
+            output: what it turned into, relative to src/<book>
+            mdhash: hash of the markdown (topics only)
+            anchors, links: the ids/names and internal hrefs in it, if it has any (topics only, see checklinks())
+            title, description, headings, words: for the book's data file (topics only, see writebookdata())
+    """
+    try:
+        with open(Path(destdir) / MANIFEST_NAME) as f:
+            manifest = json.load(f)
+        if manifest.get("version") == CONVERTER_VERSION and manifest.get("rules") == RULESET_ID:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {"version": CONVERTER_VERSION, "rules": RULESET_ID, "files": {}}
+
+def savemanifest(destdir, manifest):
+    # writeifchanged goes through a temp file, so a crash can't leave half a manifest behind
+    Path(destdir).mkdir(parents=True, exist_ok=True)
+    writeifchanged(Path(destdir) / MANIFEST_NAME, json.dumps(manifest, sort_keys=True))
+
+if __name__ == "__main__":
+    main()